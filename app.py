@@ -1,83 +1,23 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
-import tempfile, os, shutil, time, io, zipfile, re, base64, pytz
+import tempfile, os, time, json, shutil, multiprocessing
+import importlib.machinery
+from html import escape
 from pathlib import Path
-from datetime import datetime
-from typing import Tuple
-from openpyxl import load_workbook
-from xylella_processor import process_pdf
-
-# ───────────────────────────────────────────────
-# Limpa ficheiros temporários
-# ───────────────────────────────────────────────
-def clean_old_tmp_artifacts():
-    """
-    Limpa ficheiros antigos em /tmp gerados por versões anteriores da app
-    (xylella_session_*, *_ocr_debug.txt, process_log.csv, process_summary_*.txt).
-    Corre no arranque da app.
-    """
-    base_tmp = Path(tempfile.gettempdir())
-
-    # Limpa pastas de sessão antigas
-    for d in base_tmp.glob("xylella_session_*"):
-        try:
-            shutil.rmtree(d, ignore_errors=True)
-            print(f"🧹 Apagada pasta de sessão antiga: {d}")
-        except Exception as e:
-            print(f"⚠️ Não foi possível apagar {d}: {e}")
-
-    # Limpa ficheiros de debug soltos no /tmp
-    for pattern in ["*_ocr_debug.txt", "process_log.csv", "process_summary_*.txt"]:
-        for f in base_tmp.glob(pattern):
-            try:
-                f.unlink()
-                print(f"🧹 Apagado artefacto antigo: {f}")
-            except Exception as e:
-                print(f"⚠️ Não foi possível apagar {f}: {e}")
-
-    # Limpa PDFs temporários soltos
-    for f in base_tmp.glob("*.pdf"):
-        try:
-            f.unlink()
-            print(f"🧹 PDF temporário antigo removido: {f}")
-        except Exception as e:
-            print(f"⚠️ Não foi possível remover {f}: {e}")
-
-    # Limpa diretórios vazios restantes
-    for d in base_tmp.iterdir():
-        try:
-            if d.is_dir() and not any(d.iterdir()):
-                d.rmdir()
-                print(f"🧹 Diretório vazio removido: {d}")
-        except Exception:
-            pass
-
-
-def clean_temp_folder(path: str | Path):
-    """Apaga a pasta temporária indicada, com debug opcional."""
-    path = Path(path)
-    if not path.exists():
-        print(f"ℹ️ Pasta {path} já não existe.")
-        return
-
-    remaining = []
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            remaining.append(os.path.join(root, file))
-
-    if remaining:
-        print("⚠️ Ficheiros temporários ainda presentes:")
-        for f in remaining:
-            print("   └──", f)
-    else:
-        print("✅ Pasta temporária vazia.")
-
-    try:
-        shutil.rmtree(path, ignore_errors=True)
-        print("🧹 Pasta temporária apagada com sucesso.")
-    except Exception as e:
-        print(f"❌ Erro ao apagar a pasta temporária: {e}")
-
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from xylella_processor import ocr_pdf, process_ocr_with_stats
+from core_xylella import TEMPLATE_PATH, AZURE_MAX_CONCURRENCY
+from app_utils import (
+    APP_CSS,
+    clean_old_tmp_artifacts,
+    clean_temp_folder,
+    link_or_copy,
+    save_upload,
+    build_zip_with_summary,
+    throttled_progress,
+)
 
 # ───────────────────────────────────────────────
 # Configuração base
@@ -96,46 +36,7 @@ if "processed_files" not in st.session_state:
 # ───────────────────────────────────────────────
 # CSS — estilo azul + animações suaves
 # ───────────────────────────────────────────────
-st.markdown("""
-<style>
-.stButton > button[kind="primary"]{
-  background:#CA4300!important;border:1px solid #CA4300!important;color:#fff!important;
-  font-weight:600!important;border-radius:6px!important;transition:background-color .2s ease-in-out!important;
-}
-.stButton > button[kind="primary"]:hover{background:#A13700!important;border-color:#A13700!important;}
-[data-testid="stFileUploader"]>div:first-child{border:2px dashed #CA4300!important;border-radius:10px!important;padding:1rem!important}
-
-/* Caixas */
-.file-box{border-radius:8px;padding:.6rem 1rem;margin-bottom:.5rem;opacity:0;animation:fadeIn .4s ease forwards}
-@keyframes fadeIn{from{opacity:0;transform:translateY(-4px)}to{opacity:1;transform:translateY(0)}}
-.fadeOut{animation:fadeOut .5s ease forwards}
-@keyframes fadeOut{from{opacity:1;transform:translateY(0)}to{opacity:0;transform:translateY(-3px)}}
-
-/* Estados */
-.file-box.active{background:#E8F1FB;border-left:4px solid #2B6CB0}
-.file-box.success{background:#e6f9ee;border-left:4px solid #1a7f37}
-.file-box.warning{background:#fff8e5;border-left:4px solid #e6a100}
-.file-box.error{background:#fdeaea;border-left:4px solid #cc0000}
-
-/* Texto */
-.file-title{font-size:.9rem;font-weight:600;color:#1A365D}
-.file-sub{font-size:.8rem;color:#2A4365}
-
-/* Pontinhos animados */
-.dots::after{content:'...';display:inline-block;animation:dots 1.5s steps(4,end) infinite}
-@keyframes dots{
-  0%,20%{color:rgba(42,67,101,0);text-shadow:.25em 0 0 rgba(42,67,101,0),.5em 0 0 rgba(42,67,101,0)}
-  40%{color:#2A4365;text-shadow:.25em 0 0 rgba(42,67,101,0),.5em 0 0 rgba(42,67,101,0)}
-  60%{text-shadow:.25em 0 0 #2A4365,.5em 0 0 rgba(42,67,101,0)}
-  80%,100%{text-shadow:.25em 0 0 #2A4365,.5em 0 0 #2A4365}
-}
-
-/* Botão clean (branco) */
-.clean-btn{background:#fff!important;border:1px solid #ccc!important;color:#333!important;font-weight:600!important;
-border-radius:8px!important;padding:.5rem 1.2rem!important;transition:all .2s ease}
-.clean-btn:hover{border-color:#999!important;color:#000!important}
-</style>
-""", unsafe_allow_html=True)
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # ───────────────────────────────────────────────
 # Estado e reset
@@ -144,6 +45,8 @@ if "stage" not in st.session_state:
     st.session_state.stage = "idle"
 if "uploads" not in st.session_state:
     st.session_state.uploads = None
+if "result" not in st.session_state:
+    st.session_state.result = None
 
 # ✅ Anti-duplicação
 if "processed_files" not in st.session_state:
@@ -151,63 +54,169 @@ if "processed_files" not in st.session_state:
 
 
 def reset_app():
+    # O ZIP da execução anterior vive numa pasta só desta sessão
+    if st.session_state.result:
+        shutil.rmtree(Path(st.session_state.result["zip_path"]).parent, ignore_errors=True)
     st.session_state.stage = "idle"
     st.session_state.uploads = None
+    st.session_state.result = None
     st.session_state.processed_files = set()
 
 
 # ───────────────────────────────────────────────
 # Auxiliares
 # ───────────────────────────────────────────────
-def read_e1_counts(xlsx_path: str) -> Tuple[int | None, int | None]:
+# Caixa de estado por ficheiro — template único; o nome vem do utilizador
+# e é escapado aqui (um "<" no nome do PDF não pode injetar HTML)
+_BOX_TPL = "<div class='file-box {cls}'><div class='file-title'>📄 {name}</div>{subs}</div>"
+_SUB_TPL = "<div class='file-sub'>{}</div>"
+
+
+def _file_box(cls: str, name: str, *subs: str) -> str:
+    return _BOX_TPL.format_map(
+        {"cls": cls, "name": escape(name), "subs": "".join(map(_SUB_TPL.format, subs))}
+    )
+
+
+# Resultados de process_pdf reaproveitáveis entre execuções:
+#   output_cache/<AAAAMMDD>/<hash do PDF>_<mtime do template>/<nome do PDF>/
+# O core carimba a data do dia (K1 e nome do Excel), por isso o dia entra na
+# chave e as pastas de dias anteriores são apagadas (_evict_old_cache). O dia
+# é fixado uma vez por lote, para um lote à meia-noite não misturar chaves.
+CACHE_DIR = Path.cwd() / "output_cache"
+_MANIFEST = "manifest.json"
+
+
+def _cache_entry(day: str, pdf_hash: str, pdf_name: str) -> Path:
+    try:
+        tpl_mtime = TEMPLATE_PATH.stat().st_mtime_ns
+    except OSError:
+        tpl_mtime = 0
+    # O nome entra na chave porque define o nome dos ficheiros gerados
+    return CACHE_DIR / day / f"{pdf_hash}_{tpl_mtime}" / Path(pdf_name).stem
+
+
+def _evict_old_cache():
+    """Apaga da cache tudo o que não seja de hoje ou de ontem (jobs a meio da meia-noite)."""
+    keep_from = f"{datetime.now() - timedelta(days=1):%Y%m%d}"
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                if not (entry.name.isdigit() and entry.name >= keep_from):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+    except FileNotFoundError:
+        pass
+
+
+def _new_job_dir(day: str) -> str:
+    """Pasta privada onde um job escreve os Excel; só entra na cache via _store_outputs."""
+    day_dir = CACHE_DIR / day
+    day_dir.mkdir(parents=True, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".job_", dir=day_dir)
+
+
+def _cached_outputs(day: str, pdf_hash: str, pdf_name: str) -> list[dict] | None:
+    """
+    Stats dos Excel já gerados no dia `day` para este PDF (conteúdo + nome) — ver
+    process_ocr_with_stats — ou None se não houver, faltarem ficheiros
+    ou o manifesto for de um formato antigo.
+    """
+    entry = _cache_entry(day, pdf_hash, pdf_name)
     try:
-        wb = load_workbook(xlsx_path, data_only=True)
-        ws = wb.worksheets[0]
-        val = str(ws["E1"].value or "")
-        m = re.search(r"(\d+)\s*/\s*(\d+)", val)
-        if m:
-            return int(m.group(1)), int(m.group(2))
-    except Exception:
+        stats = json.loads((entry / _MANIFEST).read_text(encoding="utf-8"))
+        stats = [{**r, "path": str(entry / r["path"])} for r in stats]
+        if stats and all(os.path.exists(r["path"]) for r in stats):
+            return stats
+    except (OSError, ValueError, TypeError, KeyError):
         pass
-    return None, None
+    return None
 
 
-def build_zip_with_summary(excel_files: list[str], summary_text: str) -> bytes:
+def _store_outputs(
+    day: str, pdf_hash: str, pdf_name: str, job_dir: str, stats: list[dict], debug_dir: Path
+) -> list[dict]:
     """
-    Cria um ZIP apenas com:
-      • ficheiros Excel gerados
-      • summary.txt com o resumo do processamento
-    (sem incluir ficheiros de debug OCR).
+    Publica na cache os Excel que o job escreveu em job_dir: o manifesto vai
+    para dentro da pasta e esta é renomeada para a entrada final (rename
+    atómico — outra sessão nunca vê uma entrada a meio). Resultados vazios
+    não ficam em cache, para o PDF voltar a ser tentado.
+    O texto OCR (*_ocr_debug.txt) não fica na cache: passa para debug_dir,
+    na pasta de sessão, e é apagado com ela no fim do lote.
+    Devolve os stats com os caminhos definitivos.
     """
-    mem = io.BytesIO()
-    with zipfile.ZipFile(mem, "w", zipfile.ZIP_DEFLATED) as z:
-        for p in excel_files:
-            if os.path.exists(p):
-                z.write(p, arcname=os.path.basename(p))
-        z.writestr("summary.txt", summary_text)
-    mem.seek(0)
-    return mem.read()
+    for fp in Path(job_dir).glob("*_ocr_debug.txt"):
+        shutil.move(fp, debug_dir / fp.name)
+    if not stats:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return stats
+    names = [Path(r["path"]).name for r in stats]
+    manifest = [{**r, "path": n} for r, n in zip(stats, names)]
+    (Path(job_dir) / _MANIFEST).write_text(json.dumps(manifest), encoding="utf-8")
+    entry = _cache_entry(day, pdf_hash, pdf_name)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(job_dir, entry)
+    except OSError:
+        # Outra sessão publicou o mesmo PDF entretanto: usa-se a cópia deste job
+        # (a pasta fica na cache do dia e sai com ela)
+        return stats
+    return [{**r, "path": str(entry / n)} for r, n in zip(stats, names)]
+
+
+# Os workers do pool saem de um forkserver (processo limpo, sem as threads do
+# Streamlit nem as do OCR): um fork deste processo podia herdar um lock preso
+# noutra thread (ex.: o de stdout) e bloquear. O import do processador é feito
+# uma só vez no forkserver. Sem forkserver (Windows) fica o spawn.
+#
+# O Streamlit corre este script como __main__ sem __spec__, e o multiprocessing
+# reimportaria então o ficheiro em cada worker (a página inteira, incluindo a
+# limpeza de /tmp). Com um __spec__ chamado "__main__" — como em "python -m" —
+# os workers não reimportam o script: só precisam de xylella_processor.
+if __name__ == "__main__" and __spec__ is None:
+    __spec__ = importlib.machinery.ModuleSpec("__main__", None)
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _MP_CONTEXT.get_start_method() == "forkserver":
+    _MP_CONTEXT.set_forkserver_preload(["xylella_processor"])
+
+# Tempo máximo à espera do resultado de um PDF (OCR + parsing/Excel); um worker
+# bloqueado passa a ser um erro desse ficheiro em vez de parar o lote
+JOB_TIMEOUT = 600
+
+
+def _as_count(v) -> int:
+    """Contagem declarada/processada como int (None, vazio ou lixo → 0)."""
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return 0
 
 
 # ───────────────────────────────────────────────
 # Interface principal
 # ───────────────────────────────────────────────
 if st.session_state.stage == "idle":
-    uploads = st.file_uploader(
-        "📂 Carrega um ou vários PDFs",
-        type=["pdf"],
-        accept_multiple_files=True,
-        key="file_uploader",
-    )
-    if uploads:
-        if st.button("📄 Processar ficheiros de Input", type="primary"):
-            st.session_state.uploads = uploads
-            st.session_state.stage = "processing"
-            st.rerun()
-    else:
-        st.info("💡 Carrega um ficheiro PDF para ativar o botão de processamento.")
-
-elif st.session_state.stage == "processing":
+    idle_area = st.empty()
+    with idle_area.container():
+        uploads = st.file_uploader(
+            "📂 Carrega um ou vários PDFs",
+            type=["pdf"],
+            accept_multiple_files=True,
+            key="file_uploader",
+        )
+        start = False
+        if uploads:
+            start = st.button("📄 Processar ficheiros de Input", type="primary")
+        else:
+            st.info("💡 Carrega um ficheiro PDF para ativar o botão de processamento.")
+    if start:
+        # Processa já neste passo (sem st.rerun); só se limpa a área de upload
+        st.session_state.uploads = uploads
+        st.session_state.stage = "processing"
+        idle_area.empty()
+
+if st.session_state.stage == "processing":
     st.info("⏳ A processar ficheiros... aguarde até o processo terminar.")
     uploads = st.session_state.uploads
     session_dir = tempfile.mkdtemp(prefix="xylella_session_")
@@ -216,172 +225,246 @@ elif st.session_state.stage == "processing":
     start_ts = time.time()
 
     all_excel = []
+    file_boxes = []
     summary_lines = []
     error_count = 0
     warning_count = 0
+    duplicate_count = 0
+    total_amostras = 0
     total = len(uploads)
     progress = st.progress(0.0)
-
+    last_progress = 0.0
+
+    # 1.º passo: grava os uploads; os que não estão em cache vão para o OCR Azure
+    # (threads — é espera de rede) e depois para parsing/Excel num pool de
+    # processos (CPU-bound — threads ficariam presas no GIL)
+    _evict_old_cache()
+    cache_day = f"{datetime.now():%Y%m%d}"
+    jobs = {}
+    duplicates = {}  # índice → nome do 1.º upload com o mesmo conteúdo
+    seen_hashes = {}
+    repeated_names = set()  # índices com um nome já visto neste lote
+    seen_names = set()
     for i, up in enumerate(uploads, start=1):
         if up.name in st.session_state.processed_files:
-            progress.progress(i / total)
             continue
+        # ✅ Anti-duplicação por nome também dentro do lote: processed_files só
+        # é preenchido no 2.º passo, e o mesmo nome daria o mesmo Excel
+        if up.name in seen_names:
+            repeated_names.add(i)
+            continue
+        seen_names.add(up.name)
+        # Subpasta determinística por upload dentro da pasta de sessão
+        tmpdir = Path(session_dir) / f"job_{i}"
+        tmpdir.mkdir()
+        tmp_pdf = tmpdir / up.name
+        pdf_hash = save_upload(up, tmp_pdf)
+        if pdf_hash in seen_hashes:
+            # Mesmas requisições → não repetir o OCR nem duplicar amostras no ZIP
+            duplicates[i] = seen_hashes[pdf_hash]
+            continue
+        seen_hashes[pdf_hash] = up.name
+        jobs[i] = (pdf_hash, tmp_pdf, _cached_outputs(cache_day, pdf_hash, up.name))
 
-        placeholder = st.empty()
-        placeholder.markdown(
-            f"""
-            <div class='file-box active'>
-              <div class='file-title'>📄 {up.name}</div>
-              <div class='file-sub'>Ficheiro {i} de {total} — a processar<span class="dots"></span></div>
-            </div>
-            """,
-            unsafe_allow_html=True,
+    pending = [i for i, (_, _, cached) in jobs.items() if cached is None]
+    pdf_pool = (
+        ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(pending)), mp_context=_MP_CONTEXT
         )
-
-        tmpdir = Path(tempfile.mkdtemp(dir=session_dir))
-        tmp_pdf = tmpdir / up.name
-        with open(tmp_pdf, "wb") as f:
-            f.write(up.getbuffer())
-
-        # OUTPUT_DIR por sessão / por PDF
-        os.environ["OUTPUT_DIR"] = str(tmpdir)
-
-        created = process_pdf(str(tmp_pdf))
-
-        # ───────────────────────────────────────────────
-        # DEBUG NO ECRÃ (DESATIVADO, MAS PRONTO A USAR)
-        # ───────────────────────────────────────────────
-        # debug_files = list(tmpdir.glob("*_ocr_debug.txt"))
-        # if debug_files:
-        #     st.subheader(f"Ficheiros OCR Debug ({up.name})")
-        #     for fpath in debug_files:
-        #         st.write(f"📄 {fpath.name}")
-        #         with open(fpath, "r", encoding="utf-8") as f:
-        #             st.text(f.read())
-
-        st.session_state.processed_files.add(up.name)
-
-        if not created:
-            error_count += 1
-            html = (
-                "<div class='file-box error'>"
-                f"<div class='file-title'>📄 {up.name}</div>"
-                "<div class='file-sub'>❌ Erro: nenhum ficheiro gerado.</div>"
-                "</div>"
-            )
-            placeholder.markdown(html, unsafe_allow_html=True)
-            summary_lines.append(f"{up.name}: erro - nenhum ficheiro gerado.")
-        else:
-            req_count = len(created)
-            sample_count_total = 0
-            discrepancies = []
-
-            for fp in created:
-                dest = final_dir / Path(fp).name
-                shutil.copy(fp, dest)
-                all_excel.append(str(dest))
-                exp, proc = read_e1_counts(str(dest))
-
-                # Substitui None ou string vazia por 0
-                exp = int(exp) if exp not in (None, "", " ") else 0
-                proc = int(proc) if proc not in (None, "", " ") else 0
-
-                if proc:
-                    sample_count_total += proc
-                    if exp != proc:
-                        discrepancies.append(
-                            f"⚠️ {Path(fp).name} (processadas: {proc} / declaradas: {exp})"
-                        )
-
-            box_class = "warning" if discrepancies else "success"
-            if discrepancies:
-                warning_count += 1
-                discrep_html = (
-                    "<div class='file-sub'>⚠️ <b>"
-                    + str(len(discrepancies))
-                    + "</b> discrepância(s):<br>"
-                    + "<br>".join(discrepancies)
-                    + "</div>"
-                )
-            else:
-                discrep_html = ""
-
-            html = (
-                f"<div class='file-box {box_class}'>"
-                f"<div class='file-title'>📄 {up.name}</div>"
-                f"<div class='file-sub'><b>{req_count}</b> requisição(ões), "
-                f"<b>{sample_count_total}</b> amostras.</div>"
-                f"{discrep_html}</div>"
+        if pending else None
+    )
+    # OCR Azure é espera de rede (polling): pode haver mais PDFs em voo do que
+    # CPUs, até ao limite de pedidos simultâneos da chave (AZURE_MAX_CONCURRENCY)
+    ocr_pool = (
+        ThreadPoolExecutor(max_workers=min(AZURE_MAX_CONCURRENCY, len(pending)))
+        if pending else None
+    )
+    ocr_futures = {}
+    job_dirs = {}
+    for i in pending:
+        job_dirs[i] = _new_job_dir(cache_day)
+        ocr_futures[i] = ocr_pool.submit(ocr_pdf, str(jobs[i][1]))
+    futures = {}  # índice → parsing/Excel no pool de processos (ou o OCR que falhou)
+
+    def result_for(i: int):
+        """
+        Espera pelo resultado do PDF i. Entretanto, cada OCR que termina segue
+        logo para o pool de processos — sempre a partir da thread do script.
+        Ao fim de JOB_TIMEOUT segundos sem resultado, TimeoutError.
+        """
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while True:
+            ocr_waiting = [f for j, f in ocr_futures.items() if j not in futures]
+            if i in futures and futures[i].done():
+                return futures[i].result()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"sem resultado ao fim de {JOB_TIMEOUT} s")
+            wait(
+                ocr_waiting + ([futures[i]] if i in futures else []),
+                timeout=remaining,
+                return_when=FIRST_COMPLETED,
             )
-            placeholder.markdown(html, unsafe_allow_html=True)
-
-            # 📋 Resumo multilinha
-            summary_lines.append(
-                f"{up.name}: {req_count} requisições, {sample_count_total} amostras"
-                + (f" ⚠️ {len(discrepancies)} discrepância(s)." if discrepancies else "")
+            for j, f in ocr_futures.items():
+                if j not in futures and f.done():
+                    # Se o OCR falhou, o próprio future relança a exceção em .result()
+                    futures[j] = f if f.exception() else pdf_pool.submit(
+                        process_ocr_with_stats, str(jobs[j][1]), f.result(), job_dirs[j]
+                    )
+
+    # Painel de estado: um só elemento, redesenhado a cada ~10% dos ficheiros
+    # (em vez de 2 mensagens por PDF); o painel final vem no estágio "done"
+    status_area = st.empty()
+    render_every = max(1, total // 10)
+
+    def render_status(done: int):
+        if done % render_every and done != total:
+            return
+        active = ""
+        if done < total:
+            active = _file_box(
+                "active",
+                uploads[done].name,
+                f"Ficheiro {done + 1} de {total} — a processar<span class='dots'></span>",
             )
+        status_area.markdown("".join(file_boxes) + active, unsafe_allow_html=True)
 
-            for fp in created:
-                name = Path(fp).name
-                exp, proc = read_e1_counts(str(fp))
+    render_status(0)
 
+    # 2.º passo: recolhe os resultados pela ordem dos uploads; os pools fecham
+    # sempre (erro ou paragem do script), cancelando o que ainda não começou e
+    # sem esperar por um worker que tenha ficado bloqueado
+    try:
+        for i, up in enumerate(uploads, start=1):
+            if i in duplicates:
+                duplicate_count += 1
+                html = _file_box(
+                    "warning",
+                    up.name,
+                    f"⚠️ Conteúdo idêntico a {escape(duplicates[i])} — não reprocessado.",
+                )
+                file_boxes.append(html)
+                summary_lines.append(f"{up.name}: duplicado de {duplicates[i]} - ignorado.")
+                st.session_state.processed_files.add(up.name)
+            elif i in repeated_names:
+                duplicate_count += 1
+                html = _file_box(
+                    "warning",
+                    up.name,
+                    "⚠️ Nome repetido neste lote — só o 1.º ficheiro foi processado.",
+                )
+                file_boxes.append(html)
+                summary_lines.append(f"{up.name}: nome repetido no lote - ignorado.")
+            if i not in jobs:
+                render_status(i)
+                last_progress = throttled_progress(progress, i / total, last_progress)
+                continue
+
+            # Mesmo PDF (conteúdo + nome) já processado → resultado vem da cache
+            pdf_hash, tmp_pdf, stats = jobs[i]
+            if stats is None:
                 try:
-                    exp = int(exp) if exp not in (None, "", " ") else 0
-                except Exception:
-                    exp = 0
-                try:
-                    proc = int(proc) if proc not in (None, "", " ") else 0
-                except Exception:
-                    proc = 0
-
-                if proc > 0 and exp != proc:
-                    if exp == 0:
-                        summary_lines.append(
-                            f"   ↳ ⚠️ {name} (processadas: {proc} / declaradas: ausente ou 0)"
-                        )
-                    else:
-                        summary_lines.append(
-                            f"   ↳ ⚠️ {name} (processadas: {proc} / declaradas: {exp})"
-                        )
-                else:
-                    summary_lines.append(f"   ↳ {name}")
-
-        progress.progress(i / total)
-        time.sleep(0.5)
+                    _, stats = result_for(i)
+                except Exception as e:
+                    # Falha só deste PDF (OCR/parsing): caixa de erro e segue o lote
+                    error_count += 1
+                    msg = str(e) or type(e).__name__
+                    msg = msg if len(msg) <= 200 else msg[:200] + "…"
+                    file_boxes.append(_file_box("error", up.name, f"❌ Erro: {escape(msg)}"))
+                    summary_lines.append(f"{up.name}: erro - {msg}")
+                    shutil.rmtree(job_dirs[i], ignore_errors=True)
+                    render_status(i)
+                    last_progress = throttled_progress(progress, i / total, last_progress)
+                    continue
+                stats = _store_outputs(
+                    cache_day, pdf_hash, up.name, job_dirs[i], stats, tmp_pdf.parent
+                )
+
+            # ───────────────────────────────────────────────
+            # DEBUG NO ECRÃ (DESATIVADO, MAS PRONTO A USAR)
+            # ───────────────────────────────────────────────
+            # debug_files = list(tmp_pdf.parent.glob("*_ocr_debug.txt"))
+            # if debug_files:
+            #     st.subheader(f"Ficheiros OCR Debug ({up.name})")
+            #     for fpath in debug_files:
+            #         st.write(f"📄 {fpath.name}")
+            #         with open(fpath, "r", encoding="utf-8") as f:
+            #             st.text(f.read())
+
+            st.session_state.processed_files.add(up.name)
+
+            if not stats:
+                error_count += 1
+                html = _file_box("error", up.name, "❌ Erro: nenhum ficheiro gerado.")
+                file_boxes.append(html)
+                summary_lines.append(f"{up.name}: erro - nenhum ficheiro gerado.")
+            else:
+                req_count = len(stats)
+                sample_count_total = 0
+                discrepancies = []
+                detail_lines = []  # "↳" por Excel, no mesmo passo das contagens
+
+                # Contagens vêm do próprio processamento (as mesmas escritas em E1)
+                for r in stats:
+                    name = Path(r["path"]).name
+                    dest_s = str(final_dir / name)
+                    link_or_copy(r["path"], dest_s)
+                    all_excel.append(dest_s)
+
+                    exp = _as_count(r["expected"])
+                    proc = _as_count(r["processed"])
+
+                    if proc:
+                        sample_count_total += proc
+                        if exp != proc:
+                            discrepancies.append(
+                                f"⚠️ {name} (processadas: {proc} / declaradas: {exp})"
+                            )
+                            declared = exp if exp else "ausente ou 0"
+                            detail_lines.append(
+                                f"   ↳ ⚠️ {name} (processadas: {proc} / declaradas: {declared})"
+                            )
+                            continue
+                    detail_lines.append(f"   ↳ {name}")
+
+                subs = [f"<b>{req_count}</b> requisição(ões), <b>{sample_count_total}</b> amostras."]
+                if discrepancies:
+                    warning_count += 1
+                    subs.append(
+                        f"⚠️ <b>{len(discrepancies)}</b> discrepância(s):<br>"
+                        + "<br>".join(map(escape, discrepancies))
+                    )
+                html = _file_box("warning" if discrepancies else "success", up.name, *subs)
+                file_boxes.append(html)
+
+                total_amostras += sample_count_total
+
+                # 📋 Resumo multilinha
+                summary_lines.append(
+                    f"{up.name}: {req_count} requisições, {sample_count_total} amostras"
+                    + (f" ⚠️ {len(discrepancies)} discrepância(s)." if discrepancies else "")
+                )
+
+                summary_lines.extend(detail_lines)
 
+            render_status(i)
+            last_progress = throttled_progress(progress, i / total, last_progress)
+    finally:
+        for pool in (ocr_pool, pdf_pool):
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
     total_time = time.time() - start_ts
-    lisbon_tz = pytz.timezone("Europe/Lisbon")
+    lisbon_tz = ZoneInfo("Europe/Lisbon")
     now_local = datetime.now(lisbon_tz)
     total_reqs = len(all_excel)
 
-    # 🧪 cálculo rigoroso — soma só 1 valor por PDF
-    total_amostras = 0
-    pdf_seen = set()
-
-    for l in summary_lines:
-        if l.strip().startswith("↳"):
-            continue
-
-        pdf_name = l.split(":")[0].strip()
-        if pdf_name in pdf_seen:
-            continue
-        pdf_seen.add(pdf_name)
-
-        m_proc = re.search(r"processadas:\s*(\d+)", l)
-        m_amos = re.search(r"(\d+)\s+amostra", l)
-
-        if m_proc:
-            total_amostras += int(m_proc.group(1))
-        elif m_amos:
-            total_amostras += int(m_amos.group(1))
-
     summary_text = "\n".join(summary_lines)
     summary_text += f"\n\n📊 Total: {len(all_excel)} ficheiro(s) Excel"
     summary_text += f"\n🧪 Total de amostras: {total_amostras}"
     summary_text += f"\n⏱️ Tempo total: {total_time:.1f} segundos"
     summary_text += f"\n📅 Executado em: {now_local:%d/%m/%Y às %H:%M:%S}"
 
-    # 🧹 Limpeza da pasta temporária de sessão (inclui OCR debug)
+    # 🧹 Limpeza da pasta temporária de sessão (PDFs carregados e OCR debug)
     try:
         clean_temp_folder(session_dir)
         summary_text += "\n🧹 Pasta temporária apagada com sucesso."
@@ -390,35 +473,63 @@ elif st.session_state.stage == "processing":
 
     if warning_count:
         summary_text += f"\n⚠️ {warning_count} ficheiro(s) com discrepâncias"
+    if duplicate_count:
+        summary_text += f"\n🔁 {duplicate_count} ficheiro(s) duplicado(s) ignorado(s)"
     if error_count:
         summary_text += f"\n❌ {error_count} ficheiro(s) com erro (sem ficheiros Excel gerados)"
 
-    # ZIP só com Excel + summary.txt
-    zip_bytes = build_zip_with_summary(all_excel, summary_text)
+    # ZIP só com Excel + summary.txt, numa pasta própria desta sessão (o nome
+    # só tem resolução de 1 s; output_final é partilhado entre sessões)
     zip_name = f"xylella_output_{now_local:%Y%m%d_%H%M%S}.zip"
+    result_dir = Path(tempfile.mkdtemp(prefix="xylella_result_"))
+    zip_path = build_zip_with_summary(all_excel, summary_text, result_dir / zip_name)
+
+    # Resultado guardado em sessão: os reruns seguintes só desenham a UI
+    st.session_state.result = {
+        "file_boxes": file_boxes,
+        "zip_path": str(zip_path),
+        "zip_name": zip_name,
+        "total_reqs": total_reqs,
+        "total_amostras": total_amostras,
+        "total_time": total_time,
+        "executed_at": f"{now_local:%d/%m/%Y às %H:%M:%S}",
+    }
+    st.session_state.stage = "done"
+    st.rerun()
+
+elif st.session_state.stage == "done":
+    result = st.session_state.result
+
+    for html in result["file_boxes"]:
+        st.markdown(html, unsafe_allow_html=True)
 
     st.markdown(
         f"""
     <div style='text-align:center;margin-top:1.5rem;'>
       <h3>🏁 Processamento concluído!</h3>
-      <p>Foram gerados <b>{total_reqs}</b> ficheiro(s) Excel,
-      com um total de <b>{total_amostras}</b> amostras processadas.<br>
-      Tempo total de execução: <b>{total_time:.1f} segundos</b>.<br>
-      Executado em: <b>{now_local:%d/%m/%Y às %H:%M:%S}</b>.</p>
+      <p>Foram gerados <b>{result['total_reqs']}</b> ficheiro(s) Excel,
+      com um total de <b>{result['total_amostras']}</b> amostras processadas.<br>
+      Tempo total de execução: <b>{result['total_time']:.1f} segundos</b>.<br>
+      Executado em: <b>{result['executed_at']}</b>.</p>
     </div>""",
         unsafe_allow_html=True,
     )
 
-    zip_b64 = base64.b64encode(zip_bytes).decode()
-
     col1, col2 = st.columns(2)
     with col1:
-        st.markdown(
-            f"<a href='data:application/zip;base64,{zip_b64}' download='{zip_name}'>"
-            "<button class='clean-btn' style='width:100%;'>⬇️ Descarregar resultados (ZIP)</button>"
-            "</a>",
-            unsafe_allow_html=True,
-        )
+        try:
+            fh = open(result["zip_path"], "rb")
+        except FileNotFoundError:
+            st.warning("⚠️ O ZIP desta execução já não está disponível — faz um novo processamento.")
+        else:
+            with fh:
+                st.download_button(
+                    "⬇️ Descarregar resultados (ZIP)",
+                    data=fh,
+                    file_name=result["zip_name"],
+                    mime="application/zip",
+                    use_container_width=True,
+                )
     with col2:
         st.button(
             "🔁 Novo processamento",
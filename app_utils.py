@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Auxiliares da app Streamlit (limpeza de temporários, uploads, ZIP, CSS).
+Importado uma só vez — os reruns do Streamlit não voltam a compilar este módulo.
+"""
+
+import os
+import re
+import hashlib
+import time
+import shutil
+import zipfile
+import tempfile
+import uuid
+import errno
+from pathlib import Path
+
+# Artefactos deixados em /tmp por sessões/versões anteriores
+_TMP_SESSION_PREFIX = "xylella_session_"
+# ZIPs de resultado por sessão: apagados no "Novo processamento"; os de
+# sessões abandonadas saem aqui ao fim de um dia
+_TMP_RESULT_PREFIX = "xylella_result_"
+_TMP_RESULT_MAX_AGE = 24 * 3600
+_TMP_ARTIFACT_RE = re.compile(
+    r"(.*_ocr_debug\.txt|process_log\.csv|process_summary_.*\.txt|.*\.pdf)$"
+)
+
+# os.link falha com estes quando o hardlink não é possível (outro device,
+# sistema de ficheiros sem suporte); qualquer outro erro é real
+_NO_HARDLINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+# ───────────────────────────────────────────────
+# Limpa ficheiros temporários
+# ───────────────────────────────────────────────
+def clean_old_tmp_artifacts():
+    """
+    Limpa ficheiros antigos em /tmp gerados por versões anteriores da app
+    (xylella_session_*, *_ocr_debug.txt, process_log.csv, process_summary_*.txt,
+    PDFs soltos), xylella_result_* com mais de um dia e diretórios vazios.
+    Corre no arranque da app.
+    """
+    base_tmp = tempfile.gettempdir()
+
+    # Uma só listagem de /tmp; o tipo de artefacto decide-se pelo nome
+    with os.scandir(base_tmp) as it:
+        for entry in it:
+            n = entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if n.startswith(_TMP_SESSION_PREFIX):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        print(f"🧹 Apagada pasta de sessão antiga: {entry.path}")
+                    elif n.startswith(_TMP_RESULT_PREFIX):
+                        if time.time() - entry.stat().st_mtime > _TMP_RESULT_MAX_AGE:
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                            print(f"🧹 Apagado resultado antigo: {entry.path}")
+                    else:
+                        with os.scandir(entry.path) as sub:
+                            empty = next(sub, None) is None
+                        if empty:
+                            os.rmdir(entry.path)
+                            print(f"🧹 Diretório vazio removido: {entry.path}")
+                elif _TMP_ARTIFACT_RE.match(n):
+                    os.unlink(entry.path)
+                    print(f"🧹 Apagado artefacto antigo: {entry.path}")
+            except Exception as e:
+                print(f"⚠️ Não foi possível apagar {entry.path}: {e}")
+
+
+def clean_temp_folder(path: str | Path, debug: bool = False):
+    """Apaga a pasta temporária indicada; com debug=True lista o que lá restava."""
+    path = Path(path)
+    if not path.exists():
+        print(f"ℹ️ Pasta {path} já não existe.")
+        return
+
+    # A listagem custa um os.walk completo (stat a cada ficheiro) — só em debug
+    if debug:
+        remaining = []
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                remaining.append(os.path.join(root, file))
+
+        if remaining:
+            print("⚠️ Ficheiros temporários ainda presentes:")
+            for f in remaining:
+                print("   └──", f)
+        else:
+            print("✅ Pasta temporária vazia.")
+
+    try:
+        shutil.rmtree(path, ignore_errors=True)
+        print("🧹 Pasta temporária apagada com sucesso.")
+    except Exception as e:
+        print(f"❌ Erro ao apagar a pasta temporária: {e}")
+
+
+def link_or_copy(src: str | Path, dest: str | Path):
+    """
+    Coloca src em dest sem copiar bytes (hardlink) quando estão no mesmo
+    sistema de ficheiros; noutro device ou sem suporte, faz shutil.copy.
+    O original fica intacto (output_cache precisa dele para futuros hits).
+
+    Passa sempre por um nome temporário + os.replace: dest pode ser um
+    hardlink para a cache de outra sessão e nunca é escrito no sítio.
+    """
+    dest = Path(dest)
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in _NO_HARDLINK_ERRNOS:
+            raise
+        shutil.copy(src, tmp)
+    os.replace(tmp, dest)
+
+
+# ───────────────────────────────────────────────
+# Uploads
+# ───────────────────────────────────────────────
+def save_upload(up, dest: str | Path) -> str:
+    """
+    Grava o upload e devolve o blake2b do conteúdo. O UploadedFile é um
+    BytesIO: getbuffer() dá uma memoryview sem cópia, usada tanto no hash
+    como na escrita (sem read() para bytes intermédios).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with up.getbuffer() as mv, open(dest, "wb") as f:
+        h.update(mv)
+        f.write(mv)
+    return h.hexdigest()
+
+
+# ───────────────────────────────────────────────
+# CSS — estilo azul + animações suaves
+# ───────────────────────────────────────────────
+def _compact_css(css: str) -> str:
+    """Remove comentários e quebras de linha — menos bytes enviados em cada rerun."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    return re.sub(r"\s*\n\s*", "", css)
+
+
+# O Streamlit descarta elementos não emitidos num rerun, por isso o CSS
+# tem de ser enviado sempre; fica pelo menos compacto e construído uma vez.
+APP_CSS = _compact_css("""
+<style>
+.stButton > button[kind="primary"]{
+  background:#CA4300!important;border:1px solid #CA4300!important;color:#fff!important;
+  font-weight:600!important;border-radius:6px!important;transition:background-color .2s ease-in-out!important;
+}
+.stButton > button[kind="primary"]:hover{background:#A13700!important;border-color:#A13700!important;}
+[data-testid="stFileUploader"]>div:first-child{border:2px dashed #CA4300!important;border-radius:10px!important;padding:1rem!important}
+
+/* Caixas */
+.file-box{border-radius:8px;padding:.6rem 1rem;margin-bottom:.5rem;opacity:0;animation:fadeIn .4s ease forwards}
+@keyframes fadeIn{from{opacity:0;transform:translateY(-4px)}to{opacity:1;transform:translateY(0)}}
+.fadeOut{animation:fadeOut .5s ease forwards}
+@keyframes fadeOut{from{opacity:1;transform:translateY(0)}to{opacity:0;transform:translateY(-3px)}}
+
+/* Estados */
+.file-box.active{background:#E8F1FB;border-left:4px solid #2B6CB0}
+.file-box.success{background:#e6f9ee;border-left:4px solid #1a7f37}
+.file-box.warning{background:#fff8e5;border-left:4px solid #e6a100}
+.file-box.error{background:#fdeaea;border-left:4px solid #cc0000}
+
+/* Texto */
+.file-title{font-size:.9rem;font-weight:600;color:#1A365D}
+.file-sub{font-size:.8rem;color:#2A4365}
+
+/* Pontinhos animados */
+.dots::after{content:'...';display:inline-block;animation:dots 1.5s steps(4,end) infinite}
+@keyframes dots{
+  0%,20%{color:rgba(42,67,101,0);text-shadow:.25em 0 0 rgba(42,67,101,0),.5em 0 0 rgba(42,67,101,0)}
+  40%{color:#2A4365;text-shadow:.25em 0 0 rgba(42,67,101,0),.5em 0 0 rgba(42,67,101,0)}
+  60%{text-shadow:.25em 0 0 #2A4365,.5em 0 0 rgba(42,67,101,0)}
+  80%,100%{text-shadow:.25em 0 0 #2A4365,.5em 0 0 #2A4365}
+}
+</style>
+""")
+
+
+# ───────────────────────────────────────────────
+# Auxiliares
+# ───────────────────────────────────────────────
+def build_zip_with_summary(excel_files: list[str], summary_text: str, dest_path: str | Path) -> Path:
+    """
+    Cria (em disco, em dest_path) um ZIP apenas com:
+      • ficheiros Excel gerados
+      • summary.txt com o resumo do processamento
+    (sem incluir ficheiros de debug OCR).
+    """
+    dest_path = Path(dest_path)
+    # Não usar ZIP_STORED para os .xlsx: o XML do template é muito repetitivo e
+    # o Deflate interno ainda recomprime ~6x; o nível 1 custa ~8 ms por Excel.
+    with zipfile.ZipFile(dest_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+        for p in excel_files:
+            try:
+                z.write(p, arcname=os.path.basename(p))
+            except FileNotFoundError:
+                continue
+        z.writestr("summary.txt", summary_text)
+    return dest_path
+
+
+def throttled_progress(bar, value: float, last_ts: float, min_interval: float = 0.1) -> float:
+    """
+    Atualiza a barra de progresso no máximo ~10x/s (sempre no fim).
+    Devolve o instante (time.monotonic) da última atualização enviada.
+    """
+    now = time.monotonic()
+    if value >= 1.0 or now - last_ts >= min_interval:
+        bar.progress(value)
+        return now
+    return last_ts
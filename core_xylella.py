@@ -3,14 +3,17 @@
 core_xylella.py — Cloud/Streamlit (OCR Azure direto + Parser Colab + Writer por requisição)
 
 API exposta e usada pela UI (xylella_processor.py):
-    • process_pdf_sync(pdf_path) -> List[str]   # devolve lista de paths dos Excels criados
-    • process_folder_async(input_dir) -> str    # devolve path do ZIP criado
-    • write_to_template(rows, out_name, expected_count=None, source_pdf=None) -> str  # escreve 1 XLSX com base no template
+    • process_pdf_sync(pdf_path, output_dir=None) -> List[str]   # devolve lista de paths dos Excels criados
+    • process_pdf_with_stats(pdf_path, output_dir=None) -> (List[str], List[dict])  # idem + contagens por Excel
+    • process_ocr_with_stats(pdf_path, result_json, output_dir=None) -> idem, a partir do OCR já feito
+    • process_folder_async(input_dir, output_dir=None) -> str    # devolve path do ZIP criado
+    • write_to_template(rows, out_name, expected_count=None, source_pdf=None, output_dir=None) -> str  # escreve 1 XLSX com base no template
 
 Requer:
   - AZURE_API_KEY, AZURE_ENDPOINT (env)
+  - AZURE_MAX_CONCURRENCY (env, opcional) — nº máximo de PDFs em OCR ao mesmo tempo (4)
   - TEMPLATE_PATH (env) ou ficheiro 'TEMPLATE_PXf_SGSLABIP1056.xlsx' ao lado do core
-  - OUTPUT_DIR (env) — diretório onde guardar .xlsx e _ocr_debug.txt (definido pela app por sessão)
+  - output_dir (argumento) ou OUTPUT_DIR (env) — diretório onde guardar .xlsx e _ocr_debug.txt
 """
 
 import os
@@ -44,6 +47,9 @@ if not TEMPLATE_PATH.exists():
 AZURE_API_KEY = os.environ.get("AZURE_API_KEY", "")
 AZURE_ENDPOINT = os.environ.get("AZURE_ENDPOINT", "")
 MODEL_ID = os.environ.get("AZURE_MODEL_ID", "prebuilt-document")
+# Pedidos simultâneos: as chaves de escalão baixo respondem 429 se forem muitos
+AZURE_MAX_CONCURRENCY = max(1, int(os.environ.get("AZURE_MAX_CONCURRENCY", "4")))
+AZURE_MAX_RETRIES = 5
 
 # ───────────────────────────────────────────────
 # Estilos Excel
@@ -118,14 +124,15 @@ def clean_value(s: str) -> str:
 
 # ───────────────────────────────────────────────
 # Diretório de saída seguro — OBRIGATÓRIO
-# (A app Streamlit define OUTPUT_DIR por sessão)
+# (argumento explícito; OUTPUT_DIR do ambiente só como fallback —
+#  os.environ é partilhado por todas as threads/tarefas do processo)
 # ───────────────────────────────────────────────
-def get_output_dir() -> Path:
-    base = os.getenv("OUTPUT_DIR")
+def get_output_dir(output_dir=None) -> Path:
+    base = output_dir or os.getenv("OUTPUT_DIR")
     if not base:
         raise RuntimeError(
             "OUTPUT_DIR não definido pela app. "
-            "Defina os.environ['OUTPUT_DIR'] antes de usar o core_xylella."
+            "Passe output_dir ou defina os.environ['OUTPUT_DIR'] antes de usar o core_xylella."
         )
 
     d = Path(base)
@@ -146,6 +153,24 @@ def extract_all_text(result_json: Dict[str, Any]) -> str:
 # ───────────────────────────────────────────────
 # OCR Azure (PDF direto)
 # ───────────────────────────────────────────────
+def _azure_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Pedido ao Azure com nova tentativa em 429 (limite de pedidos excedido):
+    espera o Retry-After indicado ou, sem ele, 1, 2, 4, 8 s.
+    """
+    for attempt in range(AZURE_MAX_RETRIES):
+        resp = requests.request(method, url, **kwargs)
+        if resp.status_code != 429 or attempt == AZURE_MAX_RETRIES - 1:
+            return resp
+        try:
+            delay = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            delay = 2 ** attempt
+        print(f"⏳ Azure 429 — nova tentativa dentro de {delay:.0f}s")
+        time.sleep(delay)
+    return resp
+
+
 def azure_analyze_pdf(pdf_path: str) -> Dict[str, Any]:
     if not AZURE_API_KEY or not AZURE_ENDPOINT:
         raise RuntimeError("Azure não configurado (AZURE_API_KEY/AZURE_ENDPOINT).")
@@ -154,7 +179,7 @@ def azure_analyze_pdf(pdf_path: str) -> Dict[str, Any]:
     headers = {"Ocp-Apim-Subscription-Key": AZURE_API_KEY, "Content-Type": "application/pdf"}
 
     with open(pdf_path, "rb") as f:
-        resp = requests.post(url, data=f.read(), headers=headers, timeout=120)
+        resp = _azure_request("post", url, data=f.read(), headers=headers, timeout=120)
     if resp.status_code != 202:
         raise RuntimeError(f"Azure analyze falhou: {resp.status_code} {resp.text}")
 
@@ -164,7 +189,7 @@ def azure_analyze_pdf(pdf_path: str) -> Dict[str, Any]:
 
     start = time.time()
     while True:
-        r = requests.get(op, headers={"Ocp-Apim-Subscription-Key": AZURE_API_KEY}, timeout=60)
+        r = _azure_request("get", op, headers={"Ocp-Apim-Subscription-Key": AZURE_API_KEY}, timeout=60)
         j = r.json()
         st = j.get("status")
         if st == "succeeded":
@@ -1142,7 +1167,7 @@ def gerar_nome_excel_corrigido(source_pdf: str, data_envio: str) -> str:
 # ───────────────────────────────────────────────
 # Escrita no TEMPLATE — 1 ficheiro por requisição
 # ───────────────────────────────────────────────
-def write_to_template(ocr_rows, out_name, expected_count=None, source_pdf=None):
+def write_to_template(ocr_rows, out_name, expected_count=None, source_pdf=None, output_dir=None):
     if not ocr_rows:
         print(f"⚠️ {out_name}: sem linhas para escrever.")
         return None
@@ -1308,7 +1333,7 @@ def write_to_template(ocr_rows, out_name, expected_count=None, source_pdf=None):
 
     new_name = f"{data_util}_{base_name}.xlsx"
 
-    out_path = get_output_dir() / new_name
+    out_path = get_output_dir(output_dir) / new_name
     wb.save(out_path)
 
     print(f"📁 Ficheiro gravado: {out_path}")
@@ -1340,20 +1365,36 @@ def append_process_log(pdf_name, req_id, processed, expected, out_path=None, sta
 # ───────────────────────────────────────────────
 # API pública usada pela app Streamlit
 # ───────────────────────────────────────────────
-def process_pdf_sync(pdf_path: str) -> list[str]:
+def process_pdf_sync(pdf_path: str, output_dir: str | None = None) -> list[str]:
     """
     Processa um único PDF:
       - executa OCR Azure,
       - extrai requisições e amostras,
-      - gera 1 ficheiro Excel por requisição.
+      - gera 1 ficheiro Excel por requisição em `output_dir` (ou OUTPUT_DIR).
     Retorna: lista de caminhos absolutos dos ficheiros Excel criados.
     """
-    base = os.path.basename(pdf_path)
-    print(f"\n🧪 Início de processamento: {base}")
+    return process_pdf_with_stats(pdf_path, output_dir)[0]
+
+
+def process_pdf_with_stats(pdf_path: str, output_dir: str | None = None) -> tuple[list[str], list[dict]]:
+    """
+    Como process_pdf_sync, mas devolve também, por Excel criado, as contagens
+    escritas em E1: {"path", "expected" (declaradas), "processed" (linhas)}.
+    Poupa à app reabrir cada .xlsx só para ler E1.
+    """
+    print(f"\n🧪 Início de processamento: {os.path.basename(pdf_path)}")
+    return process_ocr_with_stats(pdf_path, azure_analyze_pdf(pdf_path), output_dir)
 
-    result_json = azure_analyze_pdf(pdf_path)
 
-    txt_path = get_output_dir() / f"{Path(base).stem}_ocr_debug.txt"
+def process_ocr_with_stats(pdf_path: str, result_json: Dict[str, Any], output_dir: str | None = None) -> tuple[list[str], list[dict]]:
+    """
+    Parte local de process_pdf_with_stats (parsing + Excel, CPU-bound) a partir
+    do JSON já devolvido por azure_analyze_pdf — permite à app fazer o OCR
+    (espera de rede) em threads e só esta parte em processos.
+    """
+    base = os.path.basename(pdf_path)
+
+    txt_path = get_output_dir(output_dir) / f"{Path(base).stem}_ocr_debug.txt"
     txt_path.write_text(extract_all_text(result_json), encoding="utf-8")
     print(f"📝 Texto OCR bruto guardado em: {txt_path}")
 
@@ -1364,6 +1405,7 @@ def process_pdf_sync(pdf_path: str) -> list[str]:
     print(f"✅ {base}: {len(valid_reqs)} requisição(ões) válidas, {total_amostras} amostras extraídas.")
 
     created_files = []
+    stats = []
     for i, req in enumerate(valid_reqs, start=1):
         rows = req.get("rows", [])
         expected = req.get("expected", 0)
@@ -1374,26 +1416,30 @@ def process_pdf_sync(pdf_path: str) -> list[str]:
         base_name = Path(pdf_path).stem
         out_name = f"{base_name}_req{i}.xlsx" if len(valid_reqs) > 1 else f"{base_name}.xlsx"
 
-        out_path = write_to_template(rows, out_name, expected_count=expected, source_pdf=pdf_path)
+        out_path = write_to_template(
+            rows, out_name, expected_count=expected, source_pdf=pdf_path, output_dir=output_dir
+        )
         created_files.append(out_path)
+        stats.append({"path": str(out_path), "expected": expected or 0, "processed": len(rows)})
         print(f"💾 Excel criado: {out_path}")
 
     print(f"🏁 {base}: {len(created_files)} ficheiro(s) Excel gerado(s).")
-    return [str(f) for f in created_files if Path(f).exists()]
+    stats = [r for r in stats if Path(r["path"]).exists()]
+    return [r["path"] for r in stats], stats
 
 # ───────────────────────────────────────────────
 # Processamento em lote (pasta)
 # ───────────────────────────────────────────────
-def process_folder_async(input_dir: str) -> str:
+def process_folder_async(input_dir: str, output_dir: str | None = None) -> str:
     """
-    Processa todos os PDFs em `input_dir` chamando `process_pdf_sync(pdf_path)`.
-    Usa SEMPRE o OUTPUT_DIR da sessão (definido pelo app.py).
+    Processa todos os PDFs em `input_dir` chamando `process_pdf_sync(pdf_path, output_dir)`.
+    Usa `output_dir` ou, na falta dele, o OUTPUT_DIR da sessão.
     Cria ZIP final com:
       • todos os XLSX gerados
       • summary.txt
     Retorna o caminho completo do ZIP criado dentro do OUTPUT_DIR da sessão.
     """
-    out_dir = get_output_dir()
+    out_dir = get_output_dir(output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     start_time = time.time()
@@ -1413,7 +1459,7 @@ def process_folder_async(input_dir: str) -> str:
         print(f"\n🔹 A processar: {base}")
 
         try:
-            created = process_pdf_sync(str(pdf_path))
+            created = process_pdf_sync(str(pdf_path), str(out_dir))
             excels = [f for f in created if f.lower().endswith(".xlsx")]
             all_excels.extend(excels)
             print(f"✅ {base}: {len(excels)} ficheiro(s) Excel.")
@@ -11,14 +11,16 @@ import importlib
 # Carregar o core
 core = importlib.import_module("core_xylella")
 
-def process_pdf(pdf_path: str):
+def process_pdf(pdf_path: str, output_dir: str | None = None):
     """
     Processa um PDF via core_xylella e devolve a lista de caminhos .xlsx criados.
     O core já devolve exatamente isso → List[str]
+    `output_dir` é passado explicitamente (seguro com workers em paralelo);
+    sem ele, o core usa OUTPUT_DIR do ambiente.
     """
     print(f"\n📄 A processar: {os.path.basename(pdf_path)}")
 
-    created_files = core.process_pdf_sync(pdf_path)
+    created_files = core.process_pdf_sync(pdf_path, output_dir)
 
     # Garantir que são paths válidos
     created_files = [p for p in created_files if p and Path(p).exists()]
@@ -27,6 +29,24 @@ def process_pdf(pdf_path: str):
     return created_files
 
 
+def ocr_pdf(pdf_path: str):
+    """Só o OCR Azure (espera de rede) — devolve o JSON da análise."""
+    print(f"\n📄 OCR: {os.path.basename(pdf_path)}")
+    return core.azure_analyze_pdf(pdf_path)
+
+
+def process_ocr_with_stats(pdf_path: str, result_json, output_dir: str | None = None):
+    """
+    Resto do processamento (parsing + Excel) a partir do JSON de ocr_pdf.
+    Devolve (created_files, stats), com stats por Excel:
+    {"path", "expected", "processed"} — os mesmos valores escritos em E1.
+    """
+    created_files, stats = core.process_ocr_with_stats(pdf_path, result_json, output_dir)
+
+    print(f"🟢 {len(created_files)} ficheiro(s) Excel criados.")
+    return created_files, stats
+
+
 def build_zip(paths):
     """Cria ZIP a partir de paths válidos."""
     import io, zipfile
@@ -34,7 +54,9 @@ def build_zip(paths):
     zip_buffer = io.BytesIO()
     with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
         for p in paths:
-            if Path(p).exists():
+            try:
                 zf.write(p, arcname=Path(p).name)
+            except FileNotFoundError:
+                continue
     zip_buffer.seek(0)
     return zip_buffer.getvalue()